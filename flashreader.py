@@ -35,43 +35,69 @@ http://www.idhw.com/
 """
 
 import logging
+import sys
+import zlib
+from types import MappingProxyType
+from typing import BinaryIO, Iterator, Optional, Tuple
 from pyftdi.spi import SpiController
 
+# Opcodes used by FlashReader
+_CMD_READ = 0x03
+_CMD_FAST_READ = 0x0B
+_CMD_READ_JEDEC_ID = 0x9F
+
+# Single-lane read commands: opcode and number of dummy bytes after the address
+_READ_COMMANDS = {
+    "READ": (_CMD_READ, 0),
+    "FAST_READ": (_CMD_FAST_READ, 1),
+}
+
 
 class FlashReader:
     """
     Flash reader class for SPI flash chips.
     """
 
-    COMMANDS = {
-        "READ": 0x03,
-        "FAST_READ": 0x0B,
-        "DUAL_OUTPUT_FAST_READ": 0x3B,
-        "QUAD_OUTPUT_FAST_READ": 0x6B,
-        "DUAL_IO_FAST_READ": 0xBB,
-        "QUAD_IO_FAST_READ": 0xEB,
-        "READ_STATUS_REGISTER": 0x05,
-        "WRITE_STATUS_REGISTER": 0x01,
-        "WRITE_ENABLE": 0x06,
-        "WRITE_DISABLE": 0x04,
-        "ERASE_SECTOR": 0x20,
-        "ERASE_BLOCK": 0xD8,
-        "ERASE_CHIP": 0xC7,
-        "POWER_DOWN": 0xB9,
-        "RELEASE_POWER_DOWN": 0xAB,
-        "READ_MANUFACTURER_DEVICE_ID": 0x90,
-        "READ_UNIQUE_ID": 0x4B,
-        "READ_JEDEC_ID": 0x9F,
-    }
-
-    def __init__(self, frequency: int = 1e6, mode: int = 0) -> None:
+    # Read-only command table, kept for introspection
+    COMMANDS = MappingProxyType(
+        {
+            "READ": _CMD_READ,
+            "FAST_READ": _CMD_FAST_READ,
+            "DUAL_OUTPUT_FAST_READ": 0x3B,
+            "QUAD_OUTPUT_FAST_READ": 0x6B,
+            "DUAL_IO_FAST_READ": 0xBB,
+            "QUAD_IO_FAST_READ": 0xEB,
+            "READ_STATUS_REGISTER": 0x05,
+            "WRITE_STATUS_REGISTER": 0x01,
+            "WRITE_ENABLE": 0x06,
+            "WRITE_DISABLE": 0x04,
+            "ERASE_SECTOR": 0x20,
+            "ERASE_BLOCK": 0xD8,
+            "ERASE_CHIP": 0xC7,
+            "POWER_DOWN": 0xB9,
+            "RELEASE_POWER_DOWN": 0xAB,
+            "READ_MANUFACTURER_DEVICE_ID": 0x90,
+            "READ_UNIQUE_ID": 0x4B,
+            "READ_JEDEC_ID": _CMD_READ_JEDEC_ID,
+        }
+    )
+
+    def __init__(self, frequency: int = 30e6, mode: int = 0) -> None:
+        # 30 MHz is the FT232H MPSSE limit; reads default to FAST_READ, which
+        # flash parts accept at higher clocks than the standard READ command
         logging.info("Initializing FlashReader")
         self.frequency = frequency
         self.mode = mode
         self.data = None
+        self.data_crc32 = None
         # Initialize SPI controller and configure
         self.spi = SpiController()
         self.spi.configure("ftdi://ftdi:232h:FTXLTVFX/1")
+        # Cache the RX FIFO size, used to align read segments
+        self._fifo_rx = self.spi.ftdi.fifo_sizes[1]
+        # Lower the latency timer from the 16 ms default so short USB replies
+        # are flushed right away, at the cost of more frequent host wakeups
+        self.spi.ftdi.set_latency_timer(1)
 
         # Get SPI device
         self.device = self.get_spi_device()
@@ -102,48 +128,143 @@ class FlashReader:
     def get_jedec_id(self) -> bytearray:
         """Get JEDEC ID from flash memory."""
         logging.info("Reading JEDEC ID from flash memory.")
-        data = self.device.exchange(bytes([self.COMMANDS["READ_JEDEC_ID"]]), 3)
-        hex_data = "0x" + "".join(f"{byte:02X}" for byte in data)
-        logging.debug("JEDEC ID Value: %s", hex_data)
+        data = self.device.exchange(bytes([_CMD_READ_JEDEC_ID]), 3, duplex=False)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            hex_data = "0x" + data.hex().upper()
+            logging.debug("JEDEC ID Value: %s", hex_data)
         return data
 
     def read_data(
         self,
         address: int = 0x000000,
         size: int = 0x100000,
-        chunk_size: int = 16,
+        chunk_size: int = 0xFC00,
         endianess: str = "big",
+        read_command: str = "FAST_READ",
+        sink: Optional[BinaryIO] = None,
     ) -> None:
         """
         Read data from the SPI flash memory
 
+        The read command (opcode, address and any dummy bytes) is sent once
+        and the data is then streamed with chip select held low, relying on
+        the flash auto-incrementing its address.
+
         :param address: Starting address to read from (default: 0x000000)
         :param size: Total size of data to read (default: 0x100000 (1MB))
-        :param chunk_size: Size of each chunk to read in one go (default: 16 bytes)
+        :param chunk_size: Size of each segment to read in one go, capped at
+            SpiController.PAYLOAD_MAX_LENGTH and, if at least one FTDI RX FIFO,
+            rounded down to a multiple of the FIFO size (default: 63 KiB)
         :param endianess: Byte order for the address (default: 'big')
-        :return: bytearray of read data
+        :param read_command: Read command to use, "READ" or "FAST_READ"
+            (default: "FAST_READ")
+        :param sink: Writable binary file to stream data to instead of keeping
+            it in memory; self.data is left empty (default: None)
+        :return: None; data is stored in self.data (unless streaming) and its
+            CRC32 in self.data_crc32
+        :raises ValueError: If size or chunk_size is not positive, or
+            read_command is invalid
         """
 
-        address_str = f"0x{address:08X}"
-        size_str = f"0x{size:08X}"
+        if size <= 0:
+            raise ValueError("size must be positive")
+
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
 
+        # The FT232H MPSSE engine has a single data input, so the dual and
+        # quad read commands cannot be used
+        if read_command not in _READ_COMMANDS:
+            raise ValueError("read_command must be 'READ' or 'FAST_READ'")
+
+        # pyftdi rejects reads larger than PAYLOAD_MAX_LENGTH; keep segments
+        # to whole FIFOs so no segment ends with a short USB transfer
+        chunk_size = min(chunk_size, SpiController.PAYLOAD_MAX_LENGTH)
+        if chunk_size >= self._fifo_rx:
+            chunk_size -= chunk_size % self._fifo_rx
+
+        # Let logging apply the hex formatting only if the record is emitted
         logging.info(
-            "Reading data from address %s, size %s, chunk size %s bytes, endianess %s",
-            address_str,
-            size_str,
+            "Reading data from address 0x%08X, size 0x%08X, chunk size %s bytes, "
+            "endianess %s, command %s",
+            address,
+            size,
             chunk_size,
             endianess,
+            read_command,
         )
         # Read command
-        read_cmd = bytes([self.COMMANDS["READ"]])
-        self.data = bytearray()
+        opcode, dummy_bytes = _READ_COMMANDS[read_command]
+        read_cmd = bytes([opcode])
+        dummy = bytes(dummy_bytes)
+        # Preallocate the buffer and fill it in place, unless streaming. It is
+        # only stored in self.data once the whole read has completed.
+        self.data = None
+        self.data_crc32 = None
+        if sink is None:
+            data = bytearray(size)
+            buffer = memoryview(data)
+
+        # Send the read command once, leaving chip select asserted. Half
+        # duplex so no dummy bytes are clocked out while reading.
+        command = read_cmd + address.to_bytes(3, byteorder=endianess) + dummy
+        self.device.exchange(command, start=True, stop=False, duplex=False)
+
+        # Stream data, releasing chip select after the last segment. The
+        # CRC32 is updated per segment.
+        read = self.device.read
+        last_offset = (size - 1) // chunk_size * chunk_size
+        cs_released = False
+        crc = 0
+        try:
+            for offset in range(0, size, chunk_size):
+                length = min(chunk_size, size - offset)
+                chunk = read(length, start=False, stop=offset == last_offset)
+                cs_released = offset == last_offset
+                crc = zlib.crc32(chunk, crc)
+                if sink is None:
+                    buffer[offset : offset + length] = chunk
+                else:
+                    sink.write(chunk)
+        finally:
+            # Release chip select if the read stopped before the last segment,
+            # so later commands are not sent inside the open read. pyftdi only
+            # sends the chip select epilog along with data, so clock one byte.
+            if not cs_released:
+                read(1, start=False, stop=True)
+        if sink is None:
+            self.data = data
+        self.data_crc32 = crc
+
+    def checksum(self) -> Optional[int]:
+        """
+        Get the CRC32 of the last read, computed as the data was streamed.
 
-        # Read data
-        for addr in range(address, address + size, chunk_size):
-            # Build full read command including address and chunk size
-            command = read_cmd + addr.to_bytes(3, byteorder=endianess)
-            chunk = self.device.exchange(command, chunk_size)
-            self.data.extend(chunk)
+        :return: CRC32 of the data, or None if nothing has been read
+        """
+        if self.data_crc32 is None:
+            logging.warning("No data to checksum.")
+            return None
+
+        logging.info("Data CRC32: 0x%08X", self.data_crc32)
+        return self.data_crc32
+
+    def _hex_lines(self, chunk_size: int = 16) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (offset, hex string) pairs for each chunk_size bytes of data.
+
+        Data is converted to hex a block of lines at a time, so the per-byte
+        work happens in a single bytes.hex() call rather than once per line.
+
+        :param chunk_size: Number of bytes per line
+        """
+        width = chunk_size * 3
+        block_size = chunk_size * 4096
+        data = memoryview(self.data)
+        for base in range(0, len(data), block_size):
+            hex_block = data[base : base + block_size].hex(" ").upper()
+            for pos in range(0, len(hex_block), width):
+                yield base + pos // 3, hex_block[pos : pos + width - 1]
 
     def save(self, filename: str, filetype: str = "binary") -> None:
         """
@@ -173,11 +294,11 @@ class FlashReader:
 
         # Write hex string dump to text file
         elif filetype == "text":
-            with open(filename, "w", encoding="utf-8") as text_file:
-                for i in range(0, len(self.data), 16):
-                    chunk = self.data[i : i + 16]
-                    hex_data = " ".join(f"{byte:02X}" for byte in chunk)
-                    text_file.write(f"0x{i:08X}: {hex_data}\n")
+            # Use a 1 MiB buffer so lines are flushed to disk in large writes
+            with open(filename, "w", encoding="utf-8", buffering=1 << 20) as text_file:
+                text_file.writelines(
+                    f"0x{i:08X}: {hex_data}\n" for i, hex_data in self._hex_lines()
+                )
             logging.info("Hex dump written to %s", filename)
 
     def show(self, chunk_size=16) -> None:
@@ -188,11 +309,9 @@ class FlashReader:
         """
         logging.info("Displaying data.")
         if self.data:
-            for i in range(0, len(self.data), chunk_size):
-                chunk = self.data[i : i + chunk_size]
-                hex_data = " ".join(f"{byte:02X}" for byte in chunk)
-                address_str = f"{i:08X}:"
-                print("%s: %s", address_str, hex_data)
+            sys.stdout.writelines(
+                f"{i:08X}: {hex_data}\n" for i, hex_data in self._hex_lines(chunk_size)
+            )
         else:
             logging.warning("No data to display.")
 
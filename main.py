@@ -56,9 +56,9 @@ def main():
     try:
         reader = FlashReader()
         jedec_id = reader.get_jedec_id()
-        logging.info("JEDEC ID: 0x%s", jedec_id.hex())
+        logging.info("JEDEC ID: 0x%s", jedec_id.hex().upper())
 
-        # reader.read_data(0, 0x7FFFFF, 256)
+        # reader.read_data(0, 0x7FFFFF)
         # reader.show()
         # reader.save("flash_dump.bin", "binary")
         # reader.save("flash_dump.txt", "text")